@@ -1,8 +1,12 @@
-import os, json, time, asyncio, requests, sys
+import os, re, time, asyncio, hashlib, sys
+import aiohttp
 import discord
+import msgpack
+import orjson
 from pathlib import Path
-from typing import Dict, Any, List, Tuple
+from typing import Dict, Any, List, Optional, Tuple
 from dotenv import load_dotenv
+from yarl import URL
 load_dotenv()
 
 # ====== CONFIG VIA ENV VARS ======
@@ -19,41 +23,45 @@ CANVAS_TOKEN = os.getenv("CANVAS_TOKEN", "").strip()
 CANVAS_COOKIE_RAW = os.getenv("COOKIES_JSON", "").strip()
 
 POLL_INTERVAL_SEC = int(os.getenv("INTERVAL_SEC", "30"))  # 15 min default
+MAX_INTERVAL_SEC = int(os.getenv("MAX_INTERVAL_SEC", "300"))  # backoff cap while Canvas keeps answering 304
+
+# opt-in: !refresh needs the privileged Message Content intent enabled in the Developer Portal
+ENABLE_REFRESH_CMD = os.getenv("ENABLE_REFRESH_CMD", "").strip().lower() in ("1", "true", "yes")
 
 STATE_DIR = Path(os.getenv("STATE_DIR", ".canvas_state"))
 STATE_DIR.mkdir(parents=True, exist_ok=True)
-SNAPSHOT_FILE = STATE_DIR / f"quiz_assignment_overrides_{COURSE_ID}.json"
+SNAPSHOT_FILE = STATE_DIR / f"quiz_assignment_overrides_{COURSE_ID}.msgpack"
+LEGACY_SNAPSHOT_FILE = SNAPSHOT_FILE.with_suffix(".json")  # read-only, until the first msgpack save
 ETAG_FILE = STATE_DIR / f"quiz_assignment_overrides_{COURSE_ID}.etag"
+HASH_FILE = STATE_DIR / f"quiz_assignment_overrides_{COURSE_ID}.hash"
+BODY_HASH_FILE = STATE_DIR / f"quiz_assignment_overrides_{COURSE_ID}.body.hash"
 
 # ====== Helpers ======
 def parse_cookie_string(raw: str) -> Dict[str, str]:
     """Convert 'k=v; a=b; ...' into {k:v, a:b}."""
-    cookies = {}
-    if not raw:
-        return cookies
-    parts = [p.strip() for p in raw.split(";") if p.strip()]
-    for part in parts:
-        if "=" in part:
-            k, v = part.split("=", 1)
-            cookies[k.strip()] = v.strip()
-    return cookies
-
-def get_session() -> requests.Session:
-    s = requests.Session()
-    s.headers.update({"User-Agent": "CanvasQuizOverridesDiffBot/1.0"})
+    return {k.strip(): v.strip() for k, sep, v in (p.partition("=") for p in raw.split(";")) if sep and k.strip()}
+
+_SESSION: Optional[aiohttp.ClientSession] = None
+
+def create_session() -> aiohttp.ClientSession:
+    """Build the Canvas session; must be called from inside the running event loop."""
+    headers = {"User-Agent": "CanvasQuizOverridesDiffBot/1.0"}
+    jar = aiohttp.CookieJar()
     if CANVAS_TOKEN:
-        s.headers.update({"Authorization": f"Bearer {CANVAS_TOKEN}"})
+        headers["Authorization"] = f"Bearer {CANVAS_TOKEN}"
     elif CANVAS_COOKIE_RAW:
-        for name, val in parse_cookie_string(CANVAS_COOKIE_RAW).items():
-            s.cookies.set(name, val, domain="utexas.instructure.com")
-    else:
-        print("ERROR: set CANVAS_TOKEN or CANVAS_COOKIE_RAW in your environment.", file=sys.stderr)
-        sys.exit(1)
-    return s
+        jar.update_cookies(parse_cookie_string(CANVAS_COOKIE_RAW), URL(BASE_URL))
+    return aiohttp.ClientSession(
+        headers=headers,
+        cookie_jar=jar,
+        timeout=aiohttp.ClientTimeout(total=30),
+    )
 
-def fetch_all_overrides_sync() -> Tuple[Dict[str, Any], str, bool]:
+async def fetch_all_overrides() -> Tuple[Dict[str, Any], str, str, bool]:
     """
-    Returns (json_obj, etag, not_modified).
+    Returns (json_obj, etag, body_digest, not_modified).
+    not_modified is also reported when Canvas ignores If-None-Match but sends a
+    single page byte-identical to the last processed one (body_digest matches).
     Endpoint usually returns:
     {
       "quiz_assignment_overrides": [
@@ -62,78 +70,104 @@ def fetch_all_overrides_sync() -> Tuple[Dict[str, Any], str, bool]:
       ]
     }
     """
-    s = get_session()
+    s = _SESSION
+    # This endpoint has no field projection (include[]/only[]); due_dates are always sent in full.
+    # Payload size is kept down by compression instead: aiohttp negotiates gzip/deflate,
+    # plus br when the optional brotli package is installed.
     params = {"per_page": PER_PAGE}
 
+    headers = {}
     if ETAG_FILE.exists():
         et = ETAG_FILE.read_text().strip()
         if et:
-            s.headers["If-None-Match"] = et
+            headers["If-None-Match"] = et
+
+    async with s.get(ENDPOINT, params=params, headers=headers) as r:
+        if r.status == 304:
+            return {}, "", "", True
+        r.raise_for_status()
+        etag = r.headers.get("ETag", "")
+        body = await r.read()
+        links = link_rels(r)
+    nxt = links.get("next")
 
-    r = s.get(ENDPOINT, params=params, timeout=30)
-    if r.status_code == 304:
-        return {}, "", True
-    r.raise_for_status()
-    etag = r.headers.get("ETag", "")
+    body_digest = hashlib.blake2b(body, digest_size=16).hexdigest()
+    if not nxt and body_digest == load_body_digest():
+        return {}, etag, body_digest, True
+    data = orjson.loads(body)
 
-    data = r.json()
     # Some Canvas endpoints return a top-level list; normalize to object
     if isinstance(data, list):
         data = {"quiz_assignment_overrides": data}
 
     # pagination (unlikely here, but keep for safety)
-    def next_link(resp: requests.Response):
-        link = resp.headers.get("link") or resp.headers.get("Link")
-        if not link:
-            return None
-        for part in link.split(","):
-            seg, rel = part.split(";")
-            if 'rel="next"' in rel:
-                return seg.strip()[1:-1]
-        return None
-
-    nxt = next_link(r)
     items = data.get("quiz_assignment_overrides", [])
-    while nxt:
-        rr = s.get(nxt, timeout=30)
-        rr.raise_for_status()
-        more = rr.json()
-        if isinstance(more, dict):
-            items.extend(more.get("quiz_assignment_overrides", []))
-        elif isinstance(more, list):
-            items.extend(more)
-        nxt = next_link(rr)
+    if nxt:
+        last = links.get("last")
+        last_page = URL(last).query.get("page", "") if last else ""
+        if last_page.isdigit():
+            # numbered pages: fetch the rest concurrently, results come back in page order
+            urls = [URL(last).update_query(page=k) for k in range(2, int(last_page) + 1)]
+            for more, _ in await asyncio.gather(*(fetch_page(s, u) for u in urls)):
+                items.extend(more)
+        else:
+            # opaque (bookmark) page tokens: only the next link is known, walk it serially
+            while nxt:
+                more, nxt = await fetch_page(s, nxt)
+                items.extend(more)
 
     data["quiz_assignment_overrides"] = items
-    return data, etag, False
+    return data, etag, body_digest, False
+
+# Canvas throttles concurrent API calls (403 Rate Limit Exceeded), so cap in-flight pages;
+# created in on_ready, like _SESSION, so it binds to the running loop
+_PAGE_FETCH_LIMIT: Optional[asyncio.Semaphore] = None
+
+async def fetch_page(s: aiohttp.ClientSession, url) -> Tuple[List[Dict[str, Any]], str]:
+    """Fetch one follow-up page; returns (override items, next link or None)."""
+    async with _PAGE_FETCH_LIMIT, s.get(url) as rr:
+        rr.raise_for_status()
+        more = orjson.loads(await rr.read())
+        nxt = link_rels(rr).get("next")
+    if isinstance(more, dict):
+        return more.get("quiz_assignment_overrides", []), nxt
+    if isinstance(more, list):
+        return more, nxt
+    return [], nxt
+
+_LINK_RE = re.compile(r'<([^>]+)>\s*;\s*rel="([^"]+)"')
+
+def link_rels(resp: aiohttp.ClientResponse) -> Dict[str, str]:
+    """Parse the Link header into {rel: url}."""
+    return {rel: url for url, rel in _LINK_RE.findall(resp.headers.get("Link", ""))}
 
 # ---- Normalization for diffing ----
 DUE_KEYS = ("due_at", "unlock_at", "lock_at", "title", "base")
+DUE_AT, UNLOCK_AT, LOCK_AT, TITLE, BASE = range(len(DUE_KEYS))
 
-def normalize_due_entry(entry: Dict[str, Any]) -> Dict[str, Any]:
-    """Keep only stable fields, fill missing with None, and coerce types (e.g., booleans)."""
-    out = {}
-    for k in DUE_KEYS:
-        v = entry.get(k, None)
-        # Canvas may return booleans/strings; keep as-is, null stays None
-        out[k] = v
-    return out
+# A normalized due entry: field values in DUE_KEYS order
+DueEntry = Tuple[Any, ...]
+
+def normalize_due_entry(entry: Dict[str, Any]) -> DueEntry:
+    """Keep only stable fields (DUE_KEYS order), fill missing with None."""
+    # Canvas may return booleans/strings; keep as-is, null stays None
+    return tuple([entry.get(k) for k in DUE_KEYS])
 
-def sort_key_due(entry: Dict[str, Any]):
+def sort_key_due(entry: DueEntry):
     """Sort due entries deterministically."""
     return (
-        str(entry.get("title") or ""),
-        1 if entry.get("base") else 0,
-        str(entry.get("due_at") or ""),
-        str(entry.get("unlock_at") or ""),
-        str(entry.get("lock_at") or ""),
+        str(entry[TITLE] or ""),
+        1 if entry[BASE] else 0,
+        str(entry[DUE_AT] or ""),
+        str(entry[UNLOCK_AT] or ""),
+        str(entry[LOCK_AT] or ""),
     )
 
-def normalize_payload_to_index(data: Dict[str, Any]) -> Dict[str, List[Dict[str, Any]]]:
+def normalize_payload_to_index(data: Dict[str, Any]) -> Dict[int, List[DueEntry]]:
     """
-    Convert API JSON -> { str(quiz_id): [normalized due entries sorted] }
+    Convert API JSON -> { int(quiz_id): [normalized due entries sorted] }
     """
-    out: Dict[str, List[Dict[str, Any]]] = {}
+    out: Dict[int, List[DueEntry]] = {}
     arr = data.get("quiz_assignment_overrides", [])
     for item in arr:
         qid = item.get("quiz_id")
@@ -143,36 +177,92 @@ def normalize_payload_to_index(data: Dict[str, Any]) -> Dict[str, List[Dict[str,
         due_dates = item.get("due_dates", []) or []
         norm_list = [normalize_due_entry(d) for d in due_dates]
         norm_list.sort(key=sort_key_due)
-        out[str(qid)] = norm_list
+        out[int(qid)] = norm_list
     return out
 
 # ---- Snapshot I/O ----
-def load_snapshot() -> Dict[str, List[Dict[str, Any]]]:
-    if not SNAPSHOT_FILE.exists():
-        return {}
+def write_state_file(path: Path, buf: bytes):
+    """Atomically replace path with buf; no-op when the file already holds exactly buf."""
+    try:
+        if path.read_bytes() == buf:
+            return
+    except FileNotFoundError:
+        pass
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    tmp.write_bytes(buf)
+    os.replace(tmp, path)
+
+def load_snapshot() -> Dict[int, List[DueEntry]]:
     try:
-        return json.loads(SNAPSHOT_FILE.read_text())
+        if SNAPSHOT_FILE.exists():
+            raw = msgpack.unpackb(SNAPSHOT_FILE.read_bytes(), raw=False, strict_map_key=False)
+        elif LEGACY_SNAPSHOT_FILE.exists():
+            raw = orjson.loads(LEGACY_SNAPSHOT_FILE.read_bytes())
+        else:
+            return {}
+        # JSON keys are strings and entries are arrays (objects in the oldest snapshots)
+        return {
+            int(qid): [normalize_due_entry(e) if isinstance(e, dict) else tuple(e) for e in entries]
+            for qid, entries in raw.items()
+        }
     except Exception:
         return {}
 
-def save_snapshot(idx: Dict[str, List[Dict[str, Any]]]):
-    SNAPSHOT_FILE.write_text(json.dumps(idx, indent=2, sort_keys=True))
+def save_snapshot(idx: Dict[int, List[DueEntry]]):
+    # keys sorted so an unchanged index packs to identical bytes; use --pretty to inspect it
+    write_state_file(SNAPSHOT_FILE, msgpack.packb(dict(sorted(idx.items())), use_bin_type=True))
+
+def index_digest(idx: Dict[int, List[DueEntry]]) -> str:
+    """Content hash of a normalized index, used to skip the diff when nothing moved."""
+    return hashlib.blake2b(orjson.dumps(idx, option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS), digest_size=16).hexdigest()
+
+def load_digest() -> str:
+    if not HASH_FILE.exists():
+        return ""
+    return HASH_FILE.read_text().strip()
+
+def save_digest(digest: str):
+    write_state_file(HASH_FILE, digest.encode())
+
+def load_body_digest() -> str:
+    if not BODY_HASH_FILE.exists():
+        return ""
+    return BODY_HASH_FILE.read_text().strip()
+
+def save_body_digest(digest: str):
+    write_state_file(BODY_HASH_FILE, digest.encode())
 
 def save_etag(etag: str):
     if etag:
-        ETAG_FILE.write_text(etag)
+        write_state_file(ETAG_FILE, etag.encode())
 
 # ---- Diff logic ----
-def list_diff(a: List[Dict[str, Any]], b: List[Dict[str, Any]]) -> List[Tuple[int, Dict[str, Tuple[Any, Any]]]]:
+DueKey = Tuple[str, bool, int]
+
+def key_due_entries(entries: List[DueEntry]) -> Dict[DueKey, DueEntry]:
+    """
+    Key due entries by (title, base, n) so a diff matches entries by identity, not position.
+    n disambiguates repeated (title, base) pairs in list order.
+    """
+    out: Dict[DueKey, DueEntry] = {}
+    seen: Dict[Tuple[str, bool], int] = {}
+    for e in entries:
+        ident = (str(e[TITLE] or ""), bool(e[BASE]))
+        n = seen.get(ident, 0)
+        seen[ident] = n + 1
+        out[ident + (n,)] = e
+    return out
+
+def list_diff(a: List[DueEntry], b: List[DueEntry]) -> List[Tuple[DueKey, Dict[str, Tuple[Any, Any]]]]:
     """
-    Compare two sorted lists of due entries element-by-element.
-    If lengths differ or any entry differs, return per-index field diffs.
+    Compare two lists of due entries keyed by (title, base).
+    An entry only on one side is reported as a whole-entry add/remove; otherwise per-field diffs.
     """
-    diffs: List[Tuple[int, Dict[str, Tuple[Any, Any]]]] = []
-    maxlen = max(len(a), len(b))
-    for i in range(maxlen):
-        left = a[i] if i < len(a) else None
-        right = b[i] if i < len(b) else None
+    diffs: List[Tuple[DueKey, Dict[str, Tuple[Any, Any]]]] = []
+    amap, bmap = key_due_entries(a), key_due_entries(b)
+    for key in dict.fromkeys([*amap, *bmap]):
+        left = amap.get(key)
+        right = bmap.get(key)
         if left == right:
             continue
         field_diffs: Dict[str, Tuple[Any, Any]] = {}
@@ -180,33 +270,65 @@ def list_diff(a: List[Dict[str, Any]], b: List[Dict[str, Any]]) -> List[Tuple[in
             # whole entry added/removed
             field_diffs["<entry>"] = (left, right)
         else:
-            keys = set(left) | set(right)
-            for k in keys:
-                if left.get(k) != right.get(k):
-                    field_diffs[k] = (left.get(k), right.get(k))
+            for k, lv, rv in zip(DUE_KEYS, left, right):
+                if lv != rv:
+                    field_diffs[k] = (lv, rv)
         if field_diffs:
-            diffs.append((i, field_diffs))
+            diffs.append((key, field_diffs))
     return diffs
 
-def compute_changes_quiz(old_idx: Dict[str, List[Dict[str, Any]]],
-                         new_idx: Dict[str, List[Dict[str, Any]]]):
+def fmt_due_key(key: DueKey) -> str:
+    title, base, n = key
+    label = f"`{title}`" + (" (base)" if base else "")
+    return label + (f" #{n + 1}" if n else "")
+
+def compute_changes_quiz(old_idx: Dict[int, List[DueEntry]],
+                         new_idx: Dict[int, List[DueEntry]]):
     added_quizzes, removed_quizzes, changed_quizzes = [], [], []
-    old_ids, new_ids = set(old_idx), set(new_idx)
-
-    for qid in sorted(new_ids - old_ids, key=int):
-        added_quizzes.append(qid)
-    for qid in sorted(old_ids - new_ids, key=int):
-        removed_quizzes.append(qid)
-    for qid in sorted(old_ids & new_ids, key=int):
-        diffs = list_diff(old_idx[qid], new_idx[qid])
-        if diffs:
-            changed_quizzes.append((qid, diffs))
+    for qid in sorted(old_idx.keys() | new_idx.keys()):
+        if qid not in old_idx:
+            added_quizzes.append(qid)
+        elif qid not in new_idx:
+            removed_quizzes.append(qid)
+        else:
+            a, b = old_idx[qid], new_idx[qid]
+            # tuple lists compare in C; most quizzes are untouched between polls
+            if a == b:
+                continue
+            diffs = list_diff(a, b)
+            if diffs:
+                changed_quizzes.append((qid, diffs))
     return added_quizzes, removed_quizzes, changed_quizzes
 
 def fmt_dt(x):
     return x or "null"
 
-def render_change_message_quiz(added_qids, removed_qids, changed_qids, course_id) -> str:
+def fmt_due_entry(entry):
+    return orjson.dumps(dict(zip(DUE_KEYS, entry)) if entry is not None else None).decode()
+
+DISCORD_MSG_LIMIT = 1990  # Discord cap is 2000 chars; leave a little headroom
+
+def chunk_lines(lines: List[str], limit: int = DISCORD_MSG_LIMIT) -> List[str]:
+    """Pack lines into messages of at most limit chars, breaking on line boundaries."""
+    chunks: List[str] = []
+    buf = ""
+    for line in lines:
+        # a single over-long line is hard-split rather than truncated
+        while len(line) > limit:
+            if buf:
+                chunks.append(buf)
+                buf = ""
+            chunks.append(line[:limit])
+            line = line[limit:]
+        if buf and len(buf) + len(line) + 1 > limit:
+            chunks.append(buf)
+            buf = ""
+        buf = f"{buf}\n{line}" if buf else line
+    if buf:
+        chunks.append(buf)
+    return chunks
+
+def render_change_message_quiz(added_qids, removed_qids, changed_qids, course_id) -> List[str]:
     lines: List[str] = []
     if added_qids:
         lines.append("**➕ Quizzes added (new overrides):** " + ", ".join(f"`{q}`" for q in added_qids))
@@ -216,11 +338,11 @@ def render_change_message_quiz(added_qids, removed_qids, changed_qids, course_id
         lines.append("**✏️ Overrides changed:**")
         for qid, diffs in changed_qids:
             lines.append(f"- quiz `{qid}`")
-            for idx, fields in diffs:
+            for key, fields in diffs:
                 pretty = []
                 if "<entry>" in fields:
                     ov, nv = fields["<entry>"]
-                    pretty.append(f"entry #{idx}: {json.dumps(ov)} → {json.dumps(nv)}")
+                    pretty.append(f"entry {fmt_due_key(key)}: {fmt_due_entry(ov)} → {fmt_due_entry(nv)}")
                 else:
                     for k, (ov, nv) in fields.items():
                         # keep it compact
@@ -228,22 +350,44 @@ def render_change_message_quiz(added_qids, removed_qids, changed_qids, course_id
                             pretty.append(f"{k}: `{fmt_dt(ov)}` → `{fmt_dt(nv)}`")
                         else:
                             pretty.append(f"{k}: `{ov}` → `{nv}`")
+                    pretty.insert(0, fmt_due_key(key))
                 lines.append("   • " + "; ".join(pretty))
     if not lines:
-        return ""
+        return []
     header = f"@everyone 📣 Canvas changes detected for course `{course_id}` (quiz_assignment_overrides)"
-    return header + "\n" + "\n".join(lines)
+    return chunk_lines([header] + lines)
 
 # ====== DISCORD BOT ======
-intents = discord.Intents.none()  # we only send messages
-bot = discord.Client(intents=intents)
+intents = discord.Intents.none()  # by default we only send messages
+if ENABLE_REFRESH_CMD:
+    intents.guild_messages = True
+    intents.message_content = True
+
+class WatcherClient(discord.Client):
+    async def close(self):
+        # release the Canvas session's pooled sockets before the loop goes away
+        global _SESSION
+        if _SESSION is not None:
+            await _SESSION.close()
+            _SESSION = None
+        await super().close()
+
+bot = WatcherClient(intents=intents)
 
-async def post_message(channel_id: int, content: str):
-    channel = bot.get_channel(channel_id)
-    if not channel:
-        channel = await bot.fetch_channel(channel_id)
-    # Discord cap: 2000 chars
-    await channel.send(content[:1990])
+# set by !refresh to cut the current sleep short and poll immediately;
+# created in on_ready so it binds to the running loop (pre-3.10 asyncio binds at construction)
+_poll_now: Optional[asyncio.Event] = None
+
+# resolved on first post and cached; a failed lookup is retried on the next post
+_channel: Optional[discord.abc.Messageable] = None
+
+async def post_message(chunks: List[str]):
+    global _channel
+    if _channel is None:
+        _channel = bot.get_channel(DISCORD_CHANNEL_ID) or await bot.fetch_channel(DISCORD_CHANNEL_ID)
+    # sent one at a time so the parts arrive in order; discord.py handles rate limits
+    for chunk in chunks:
+        await _channel.send(chunk)
 
 async def watcher():
     await bot.wait_until_ready()
@@ -251,32 +395,69 @@ async def watcher():
         print("Set DISCORD_CHANNEL_ID.", file=sys.stderr)
         await bot.close()
         return
+    consecutive_304s = 0
     while not bot.is_closed():
         try:
-            data, etag, not_modified = await asyncio.to_thread(fetch_all_overrides_sync)
+            data, etag, body_digest, not_modified = await fetch_all_overrides()
             if not_modified:
-                await post_message(DISCORD_CHANNEL_ID, "Nothing Changed.")
+                consecutive_304s += 1
+                save_etag(etag)
             else:
+                consecutive_304s = 0
                 new_idx = normalize_payload_to_index(data)
-                old_idx = load_snapshot()
-                added_q, removed_q, changed_q = compute_changes_quiz(old_idx, new_idx)
-                if added_q or removed_q or changed_q:
-                    msg = render_change_message_quiz(added_q, removed_q, changed_q, COURSE_ID)
-                    if msg:
-                        await post_message(DISCORD_CHANNEL_ID, msg)
-                    save_snapshot(new_idx)
+                digest = index_digest(new_idx)
+                # only load + diff the old snapshot when the content hash moved
+                if digest != load_digest():
+                    old_idx = load_snapshot()
+                    added_q, removed_q, changed_q = compute_changes_quiz(old_idx, new_idx)
+                    if added_q or removed_q or changed_q:
+                        chunks = render_change_message_quiz(added_q, removed_q, changed_q, COURSE_ID)
+                        if chunks:
+                            await post_message(chunks)
+                        save_snapshot(new_idx)
+                    save_digest(digest)
+                # persisted only once the body has been fully handled, so a failed post is retried
+                save_body_digest(body_digest)
                 save_etag(etag)
         except Exception as e:
             print(f"[watcher] Error: {e}", file=sys.stderr)
-        await asyncio.sleep(POLL_INTERVAL_SEC)
+        # exponent is clamped so the counter can keep growing through long quiet stretches
+        sleep_for = min(POLL_INTERVAL_SEC * 2 ** min(consecutive_304s, 16), max(MAX_INTERVAL_SEC, POLL_INTERVAL_SEC))
+        try:
+            await asyncio.wait_for(_poll_now.wait(), timeout=sleep_for)
+        except asyncio.TimeoutError:
+            pass
+        _poll_now.clear()
 
 @bot.event
 async def on_ready():
+    global _SESSION, _PAGE_FETCH_LIMIT, _poll_now
     print(f"Logged in as {bot.user} (id={bot.user.id})")
+    if _SESSION is None:
+        _SESSION = create_session()
+    if _PAGE_FETCH_LIMIT is None:
+        _PAGE_FETCH_LIMIT = asyncio.Semaphore(3)
+    if _poll_now is None:
+        _poll_now = asyncio.Event()
     bot.loop.create_task(watcher())
 
+@bot.event
+async def on_message(message: discord.Message):
+    if message.author.bot or message.channel.id != DISCORD_CHANNEL_ID:
+        return
+    if message.content.strip() == "!refresh" and _poll_now is not None:
+        _poll_now.set()
+
 if __name__ == "__main__":
+    if "--pretty" in sys.argv[1:]:
+        # dump the stored snapshot in readable form and exit
+        readable = {qid: [dict(zip(DUE_KEYS, e)) for e in entries] for qid, entries in load_snapshot().items()}
+        sys.stdout.write(orjson.dumps(readable, option=orjson.OPT_INDENT_2 | orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS).decode() + "\n")
+        sys.exit(0)
     if not DISCORD_BOT_TOKEN:
         print("Set DISCORD_BOT_TOKEN env var.", file=sys.stderr)
         sys.exit(1)
+    if not (CANVAS_TOKEN or CANVAS_COOKIE_RAW):
+        print("ERROR: set CANVAS_TOKEN or CANVAS_COOKIE_RAW in your environment.", file=sys.stderr)
+        sys.exit(1)
     bot.run(DISCORD_BOT_TOKEN)